@@ -1,9 +1,14 @@
 """
 Example of upserting dataframe
 """
+import logging
+
 import pandas as pd
 from src.mongodb_helper import MongoDBHelper
 
+logging.basicConfig()
+logging.getLogger(MongoDBHelper.__module__).setLevel(logging.DEBUG)
+
 uri = "mongodb://localhost:27017/"
 helper = MongoDBHelper(uri)
 database = "test_database"
@@ -1,27 +1,161 @@
+import asyncio
+import importlib.util
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+
+import numpy as np
 import pandas as pd
 
-from pymongo import UpdateOne
+from bson import Decimal128, Int64, ObjectId, encode
+from bson.binary import UuidRepresentation
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import InsertOne, ReplaceOne, UpdateOne
 from pymongo.collection import Collection
 from pymongo.mongo_client import MongoClient
 from pymongo.database import Database
-from typing import List, Any, Optional
+from typing import Callable, Dict, Generator, List, Any, Iterator, Literal, Optional, Set, Tuple, Union
+
+try:
+    import pyarrow.parquet as pq
+    from pymongoarrow.api import find_arrow_all, find_pandas_all
+    from pymongoarrow.schema import Schema
+except ImportError:  # pymongoarrow is optional
+    pq = None
+    find_arrow_all = None
+    find_pandas_all = None
+    Schema = None
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor is optional
+    AsyncIOMotorClient = None
+
+# Number of write operations sent per bulk write by default
+DEFAULT_BATCH_SIZE = 1000
+
+# Number of rows whose existing documents are retrieved per query when diffing an upsert
+DIFF_CHUNK_SIZE = 10000
+
+# Approximate number of documents loaded in memory at a time when spilling a query result to Parquet
+SPILL_CHUNK_SIZE = 100000
+
+# Wire protocol compressors in order of preference, with the module each one requires
+# zstd requires MongoDB >= 4.2, snappy and zlib require MongoDB >= 3.6
+_COMPRESSOR_MODULES = {'zstd': 'zstandard', 'snappy': 'snappy', 'zlib': 'zlib'}
+
+
+@dataclass
+class MongoDBHelperConfig:
+    """
+    Connection pool and write concern settings of the MongoDB clients of a :class:`MongoDBHelper`.
+
+    Settings left to None are not passed to the clients, so that the URI or driver defaults apply.
+    For write-heavy upserts, ``w=1`` and ``journal=False`` trade durability for throughput.
+
+    Attributes
+    ----------
+    max_pool_size : int, optional
+        The maximum number of connections per server. Default is 50.
+    min_pool_size : int, optional
+        The number of connections per server kept open, avoiding connection handshakes
+        when a burst of operations starts. Default is 5.
+    max_idle_time_ms : int, optional
+        The number of milliseconds after which an idle connection is closed. Default is None.
+    w : int or str, optional
+        The write concern, e.g. 1 or 'majority'. Default is None.
+    journal : bool, optional
+        Whether writes wait for the journal to be committed. Default is None.
+    retry_writes : bool, optional
+        Whether failed writes are retried once. Default is None.
+    """
+    max_pool_size: Optional[int] = 50
+    min_pool_size: Optional[int] = 5
+    max_idle_time_ms: Optional[int] = None
+    w: Optional[Union[int, str]] = None
+    journal: Optional[bool] = None
+    retry_writes: Optional[bool] = None
+
+    def to_client_options(self) -> dict:
+        """
+        Convert the settings to keyword arguments of :class:`pymongo.mongo_client.MongoClient`.
+
+        Returns
+        -------
+        dict
+            The client options of the settings which are not None.
+        """
+        options = {
+            'maxPoolSize': self.max_pool_size,
+            'minPoolSize': self.min_pool_size,
+            'maxIdleTimeMS': self.max_idle_time_ms,
+            'w': self.w,
+            'journal': self.journal,
+            'retryWrites': self.retry_writes,
+        }
+        return {name: value for name, value in options.items() if value is not None}
 
 
 class MongoDBHelper:
-    def __init__(self, uri: str = None):
+    # MongoClient instances shared by all helpers, keyed by URI and client options
+    _clients: dict = {}
+
+    # Codec options of the collections used by the document and DataFrame methods
+    _DEFAULT_CODEC_OPTIONS = CodecOptions(document_class=dict,
+                                          tz_aware=False,
+                                          uuid_representation=UuidRepresentation.STANDARD,
+                                          )
+
+    def __init__(self,
+                 uri: str = None,
+                 client_options: dict = None,
+                 codec_options: CodecOptions = None,
+                 config: MongoDBHelperConfig = None,
+                 ):
         """
         Initialize MongoDBHelper instance.
 
+        Helpers created with the same URI and client options share a single
+        :class:`pymongo.mongo_client.MongoClient` and thus its connection pool.
+
+        Unless specified in the URI or the client options, wire protocol compression is
+        enabled with zstd (MongoDB >= 4.2, requires `zstandard`), snappy (requires
+        `python-snappy`) or zlib, in that order of preference.
+
         Parameters
         ----------
         uri : str, optional
             The URI for the MongoDB instance. Default is None.
+        client_options : dict, optional
+            Keyword arguments passed to :class:`pymongo.mongo_client.MongoClient`,
+            e.g. ``maxPoolSize`` or ``minPoolSize``. Default is None.
+        codec_options : bson.codec_options.CodecOptions, optional
+            The BSON codec options of the collections used by the document and DataFrame methods,
+            e.g. ``CodecOptions(tz_aware=True)`` to retrieve timezone-aware datetimes. Default is None,
+            which uses plain dict documents, naive datetimes, the standard UUID representation and
+            no custom type codecs.
+        config : MongoDBHelperConfig, optional
+            The connection pool and write concern settings of the clients. The `client_options`
+            take precedence over these settings. Default is None.
         """
         self.mongo_client = None
+        self._async_client = None
+        self._async_client_loop = None
+        self._event_loop = None
         self.uri = uri
+        self.config = config
+        self.client_options = client_options or {}
+        self.codec_options = codec_options or self._DEFAULT_CODEC_OPTIONS
         # self.uri = "mongodb://localhost:27017/"  # debug/testing
         self._database = None
         self._collection = None
+        self._collection_cache: Dict[Tuple[str, str], Collection] = {}
+        # (database, collection, primary key) triples whose primary key index has been ensured
+        self._indexed: Set[Tuple[str, str, str]] = set()
+        self._logger = logging.getLogger(__name__)
 
         self._connect_to_mongodb()
 
@@ -32,11 +166,101 @@ class MongoDBHelper:
         if self.uri is None:
             raise ValueError('Please specify MongoDB instance URI')
 
+        key = self._get_client_cache_key()
         try:
-            self.mongo_client = MongoClient(self.uri)
+            if key is None:
+                self.mongo_client = MongoClient(self.uri, **self._get_client_kwargs())
+                return
+            if key not in self._clients:
+                self._clients[key] = MongoClient(self.uri, **self._get_client_kwargs())
+            self.mongo_client = self._clients[key]
         except Exception as e:
             raise ConnectionError(f'Error connecting to MongoDB: {e}')
 
+    def _get_client_cache_key(self) -> Optional[tuple]:
+        """
+        Get the key of the shared client in :attr:`_clients`.
+
+        List and dict option values are converted to tuples. Returns None if an option value
+        is still not hashable, in which case the client is not shared.
+        """
+        def _normalize(value):
+            if isinstance(value, (list, tuple)):
+                return tuple(_normalize(item) for item in value)
+            if isinstance(value, dict):
+                return tuple(sorted((name, _normalize(item)) for name, item in value.items()))
+            return value
+
+        key = (self.uri, _normalize(self._get_client_options()))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _get_client_options(self) -> dict:
+        """
+        Get the client options of the config, updated with the client options of the helper.
+        """
+        options = self.config.to_client_options() if self.config is not None else {}
+        options.update(self.client_options)
+        return options
+
+    def _get_client_kwargs(self) -> dict:
+        """
+        Get the keyword arguments of the MongoDB clients.
+
+        The application name is set to 'MongoDBHelper' unless specified in the URI. Wire protocol
+        compression is enabled with the compressors whose modules are installed, unless compressors
+        are specified in the URI or the client options.
+        """
+        kwargs = {}
+        if 'appname=' not in self.uri.lower():
+            kwargs['appname'] = 'MongoDBHelper'
+        if 'compressors=' not in self.uri.lower():
+            compressors = [name for name, module in _COMPRESSOR_MODULES.items()
+                           if importlib.util.find_spec(module) is not None]
+            kwargs['compressors'] = ','.join(compressors)
+            kwargs['zlibCompressionLevel'] = 6
+        kwargs.update(self._get_client_options())
+        return kwargs
+
+    @property
+    def async_client(self) -> 'AsyncIOMotorClient':
+        """
+        A :class:`motor.motor_asyncio.AsyncIOMotorClient` connected to the same MongoDB instance.
+
+        A Motor client is bound to the event loop it is first used in, so the client is created on first
+        access from each event loop and the client of the previous loop is closed. Motor is only required
+        for the asynchronous methods.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self._async_client is None or self._async_client_loop is not loop:
+            if AsyncIOMotorClient is None:
+                raise ImportError('Please install motor to use the asynchronous methods')
+            if self._async_client is not None:
+                self._async_client.close()
+            self._async_client = AsyncIOMotorClient(self.uri, **self._get_client_kwargs())
+            self._async_client_loop = loop
+        return self._async_client
+
+    def close(self) -> None:
+        """
+        Close the Motor client and the event loop used by :meth:`upsert_dfs`.
+
+        The shared :class:`pymongo.mongo_client.MongoClient` is left open, since it may be used by other helpers.
+        """
+        if self._async_client is not None:
+            self._async_client.close()
+            self._async_client = None
+            self._async_client_loop = None
+        if self._event_loop is not None:
+            self._event_loop.close()
+            self._event_loop = None
+
     @property
     def database(self) -> Database:
         return self._database
@@ -83,6 +307,32 @@ class MongoDBHelper:
         if self._collection is None or (self._collection.name != collection_name):
             self._collection = self.database[collection_name]
 
+    def _get_collection(self, database_name: str, collection_name: str) -> Collection:
+        """
+        Get a :class:`pymongo.collection.Collection` object, cached by database and collection names.
+
+        The collection uses the codec options of the helper.
+
+        Parameters
+        ----------
+        database_name : str
+            The name of the MongoDB database.
+        collection_name : str
+            The name of the MongoDB collection.
+
+        Returns
+        -------
+        pymongo.collection.Collection
+            The MongoDB collection.
+        """
+        key = (database_name, collection_name)
+        collection = self._collection_cache.get(key)
+        if collection is None:
+            collection = self.mongo_client[database_name][collection_name].with_options(
+                codec_options=self.codec_options)
+            self._collection_cache[key] = collection
+        return collection
+
     def get_database_list(self) -> List[str]:
         """
         Retrieve existing database list.
@@ -109,6 +359,7 @@ class MongoDBHelper:
         """
         if database_name in self.get_database_list():
             self.mongo_client.drop_database(database_name)
+            self._indexed = {key for key in self._indexed if key[0] != database_name}
 
             # Verify deletion
             if database_name not in self.get_database_list():
@@ -153,6 +404,7 @@ class MongoDBHelper:
         self.database = database_name
         self.collection = collection_name
         r = self.database.drop_collection(collection_name)
+        self._indexed = {key for key in self._indexed if key[:2] != (database_name, collection_name)}
         if r['ok'] == 1:
             print(f'Deleted collection: {database_name}.{collection_name}')
         else:
@@ -176,11 +428,9 @@ class MongoDBHelper:
         -------
         None
         """
-        self.database = database_name
-        self.collection = collection_name
-        r = self.collection.delete_many({})
-        if r.acknowledged:
-            print(f"Cleaned collection: {database_name}.{collection_name}")
+        collection = self._get_collection(database_name, collection_name)
+        collection.delete_many({})
+        self._logger.debug('Cleaned collection: %s.%s', database_name, collection_name)
 
     def insert_one_document(self, database_name: str, collection_name: str, document: dict) -> None:
         """
@@ -199,11 +449,9 @@ class MongoDBHelper:
         -------
         None
         """
-        self.database = database_name
-        self.collection = collection_name
-        r = self.collection.insert_one(document)
-        if r.acknowledged:
-            print(f"Inserted 1 document into: {database_name}.{collection_name}")
+        collection = self._get_collection(database_name, collection_name)
+        collection.insert_one(document)
+        self._logger.debug('Inserted 1 document into: %s.%s', database_name, collection_name)
 
     def get_one_document(self,
                          database_name: str,
@@ -233,9 +481,8 @@ class MongoDBHelper:
         dict or None
             A dictionary representing the document.
         """
-        self.database = database_name
-        self.collection = collection_name
-        result = self.collection.find_one(filter, *args, **kwargs)
+        collection = self._get_collection(database_name, collection_name)
+        result = collection.find_one(filter, *args, **kwargs)
         return result
 
     def delete_one_document(self, database_name: str, collection_name: str, filter: dict, *args, **kwargs) -> None:
@@ -255,14 +502,18 @@ class MongoDBHelper:
         -------
         None
         """
-        self.database = database_name
-        self.collection = collection_name
-        result = self.collection.delete_one(filter, *args, **kwargs)
+        collection = self._get_collection(database_name, collection_name)
+        result = collection.delete_one(filter, *args, **kwargs)
         if result.acknowledged:
-            print(f'Deleted {result.deleted_count} document in {database_name}.{collection_name}')
+            self._logger.debug('Deleted %d document in %s.%s', result.deleted_count, database_name, collection_name)
 
     def get_document_count(self, database_name: str, collection_name: str, filter: dict = None) -> int:
         """
+        Count the documents of a collection.
+
+        Without a filter, the count is estimated from the collection metadata instead of
+        scanning the collection.
+
         Parameters
         ----------
         database_name : str
@@ -275,18 +526,32 @@ class MongoDBHelper:
         Returns
         -------
         int
-            The count of documents that mater the filter.
+            The count of documents that match the filter.
         """
-        self.database = database_name
-        self.collection = collection_name
-        count = self.collection.count_documents(filter)
+        collection = self._get_collection(database_name, collection_name)
+        if not filter:
+            return collection.estimated_document_count()
+
+        count = collection.count_documents(filter)
         return count
 
-    def upsert_df(self, df: pd.DataFrame, database_name: str, collection_name: str, primary_key_column: str):
+    def upsert_df(self,
+                  df: pd.DataFrame,
+                  database_name: str,
+                  collection_name: str,
+                  primary_key_column: str,
+                  mode: Literal['set', 'replace', 'insert'] = 'replace',
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  ordered: bool = False,
+                  bypass_document_validation: bool = False,
+                  object_id_primary_key: bool = False,
+                  unique_primary_key: bool = False,
+                  diff_against_existing: bool = False,
+                  ):
         """
         Upsert a pandas DataFrame into a MongoDB collection.
 
-        This method converts the DataFrame to a list of dictionaries and performs an upsert operation
+        This method converts each row of the DataFrame to a dictionary and performs an upsert operation
         on each dictionary using the specified primary key column. If a document with the same primary key
         already exists in the collection, it will be updated. If no document with the primary key exists,
         a new document will be inserted.
@@ -301,32 +566,393 @@ class MongoDBHelper:
             The name of the MongoDB collection.
         primary_key_column : str
             The name of the column in the DataFrame that represents the primary key.
+        mode : {'set', 'replace', 'insert'}, optional
+            How an existing document is updated. ``'replace'`` replaces the whole document with the row,
+            removing the fields that are not columns of the DataFrame. ``'set'`` only sets the fields
+            of the DataFrame columns and keeps the other fields. ``'insert'`` inserts the rows without
+            matching existing documents, which fails for duplicate keys of a unique index.
+            Default is 'replace'.
+        batch_size : int, optional
+            The number of operations sent per bulk write. Default is 1000.
+        ordered : bool, optional
+            If True, the operations of a batch are applied in order and stop at the first error.
+            If False, the server may apply them in any order and continues after errors. Default is False.
+        bypass_document_validation : bool, optional
+            If True, the writes skip the document-level validation of the collection. Default is False.
+        object_id_primary_key : bool, optional
+            If True, the primary key values (e.g. 24-character hex strings) are converted to
+            :class:`bson.ObjectId`, and missing primary key values raise a ValueError. Default is False.
+        unique_primary_key : bool, optional
+            If True, the index created on the primary key column is unique. An index on the primary
+            key column is created on the first upsert into a collection, unless the collection already
+            has an index starting with that column. Default is False.
+        diff_against_existing : bool, optional
+            If True, the existing documents with the primary keys of the DataFrame are retrieved first
+            and only the new or changed rows are upserted. Default is False.
 
         Returns
         -------
         None
         """
-        self.database = database_name
-        self.collection = collection_name
+        self._validate_upsert_arguments(mode, batch_size)
+        if mode == 'insert' and diff_against_existing:
+            raise ValueError("Cannot diff against existing documents in 'insert' mode")
+        collection = self._get_collection(database_name, collection_name)
 
-        documents = df.to_dict('records')
-        operations = [UpdateOne(filter={primary_key_column: doc[primary_key_column]},
-                                update={'$set': doc},
-                                upsert=True,
-                                ) for doc in documents]
-        result = self.collection.bulk_write(operations)
-        if result.acknowledged:
-            print(
-                f"For {database_name}.{collection_name} - "
-                f"{result.matched_count} matched, "
-                f"{result.modified_count} modified, "
-                f"{result.upserted_count} upserted"
-            )
+        steps = self._upsert_steps(collection, df, database_name, collection_name, primary_key_column, mode,
+                                   batch_size, ordered, bypass_document_validation, object_id_primary_key,
+                                   unique_primary_key, diff_against_existing)
+        result = None
+        while True:
+            try:
+                method, args, kwargs = steps.send(result)
+            except StopIteration:
+                return
+            result = method(*args, **kwargs)
+
+    async def aupsert_df(self,
+                         df: pd.DataFrame,
+                         database_name: str,
+                         collection_name: str,
+                         primary_key_column: str,
+                         mode: Literal['set', 'replace', 'insert'] = 'replace',
+                         batch_size: int = DEFAULT_BATCH_SIZE,
+                         ordered: bool = False,
+                         bypass_document_validation: bool = False,
+                         object_id_primary_key: bool = False,
+                         unique_primary_key: bool = False,
+                         ):
+        """
+        Asynchronously upsert a pandas DataFrame into a MongoDB collection.
+
+        This is the asynchronous counterpart of :meth:`upsert_df`, using the Motor client so that
+        several upserts can be awaited concurrently, e.g. with :func:`asyncio.gather`. The arguments
+        are the same as those of :meth:`upsert_df`, except that `diff_against_existing` is not supported.
+
+        Returns
+        -------
+        None
+        """
+        self._validate_upsert_arguments(mode, batch_size)
+        collection = self.async_client[database_name][collection_name].with_options(
+            codec_options=self.codec_options)
+
+        steps = self._upsert_steps(collection, df, database_name, collection_name, primary_key_column, mode,
+                                   batch_size, ordered, bypass_document_validation, object_id_primary_key,
+                                   unique_primary_key)
+        result = None
+        while True:
+            try:
+                method, args, kwargs = steps.send(result)
+            except StopIteration:
+                return
+            result = await method(*args, **kwargs)
+
+    def upsert_dfs(self, jobs: List[Tuple[Any, ...]]) -> None:
+        """
+        Upsert several pandas DataFrames concurrently.
+
+        The upserts run on an event loop owned by the helper, which is reused across calls so that
+        the connections of the Motor client are kept open. The loop is closed by :meth:`close`.
+
+        Parameters
+        ----------
+        jobs : list of tuple
+            A list of ``(df, database_name, collection_name, primary_key_column)`` tuples,
+            each being the arguments of :meth:`aupsert_df`. The optional arguments of :meth:`aupsert_df`
+            may be appended positionally.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        RuntimeError
+            If called from a running event loop, e.g. in Jupyter. Await :meth:`aupsert_df` instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError('upsert_dfs cannot be called from a running event loop, '
+                               'await asyncio.gather over aupsert_df instead')
+
+        async def _upsert_all():
+            await asyncio.gather(*(self.aupsert_df(*job) for job in jobs))
+
+        # The Motor client is recreated for each event loop, so the same loop is reused across calls
+        # to keep the connection pool of the client
+        if self._event_loop is None:
+            self._event_loop = asyncio.new_event_loop()
+        self._event_loop.run_until_complete(_upsert_all())
 
-    def get_df(self, database_name: str, collection_name: str, filter: dict = None) -> pd.DataFrame:
+    def _upsert_steps(self,
+                      collection: Any,
+                      df: pd.DataFrame,
+                      database_name: str,
+                      collection_name: str,
+                      primary_key_column: str,
+                      mode: Literal['set', 'replace', 'insert'],
+                      batch_size: int,
+                      ordered: bool,
+                      bypass_document_validation: bool,
+                      object_id_primary_key: bool,
+                      unique_primary_key: bool,
+                      diff_against_existing: bool = False,
+                      ) -> Generator[Tuple[Callable, tuple, dict], Any, None]:
+        """
+        Generate the collection method calls of an upsert, shared by :meth:`upsert_df` and :meth:`aupsert_df`.
+
+        Each call is yielded as a ``(method, args, kwargs)`` tuple, and the result of the call must be sent
+        back to the generator. The caller runs the calls synchronously or awaits them. Diffing against
+        the existing documents is only supported by synchronous callers.
+        """
+        index_key = (database_name, collection_name, primary_key_column)
+        if primary_key_column != '_id' and index_key not in self._indexed:
+            # An existing index on the key with other options would make create_index fail
+            indexes = yield collection.index_information, (), {}
+            if not any(index['key'][0][0] == primary_key_column for index in indexes.values()):
+                yield collection.create_index, (primary_key_column,), {'unique': unique_primary_key}
+            self._indexed.add(index_key)
+
+        # The diff runs after the index is ensured, so that its lookup by primary key uses the index
+        skipped_count = None
+        if diff_against_existing:
+            changed_df = yield self._get_changed_rows, (collection, df, primary_key_column, mode,
+                                                        object_id_primary_key), {}
+            skipped_count = len(df) - len(changed_df)
+            df = changed_df
+
+        operations = self._build_upsert_operations(df,
+                                                   primary_key_column,
+                                                   mode,
+                                                   collection.codec_options,
+                                                   object_id_primary_key,
+                                                   )
+        counts = [0, 0, 0, 0]
+        for batch in self._batch_operations(operations, batch_size):
+            result = yield collection.bulk_write, (batch,), {
+                'ordered': ordered,
+                'bypass_document_validation': bypass_document_validation,
+            }
+            if result.acknowledged:
+                counts[0] += result.matched_count
+                counts[1] += result.modified_count
+                counts[2] += result.upserted_count
+                counts[3] += result.inserted_count
+        self._log_upsert_result(database_name, collection_name, *counts, skipped_count=skipped_count)
+
+    @staticmethod
+    def _validate_upsert_arguments(mode: str, batch_size: int) -> None:
+        """
+        Validate the upsert mode and batch size.
+        """
+        if mode not in ('set', 'replace', 'insert'):
+            raise ValueError(f"Invalid upsert mode: {mode}, expected 'set', 'replace' or 'insert'")
+        if batch_size < 1:
+            raise ValueError(f'Invalid batch size: {batch_size}, expected a positive integer')
+
+    @staticmethod
+    def _build_upsert_operations(df: pd.DataFrame,
+                                 primary_key_column: str,
+                                 mode: Literal['set', 'replace', 'insert'] = 'replace',
+                                 codec_options: CodecOptions = None,
+                                 object_id_primary_key: bool = False,
+                                 ) -> Iterator[Union[InsertOne, ReplaceOne, UpdateOne]]:
+        """
+        Build the bulk write operations upserting each row of a DataFrame.
+
+        The operations are generated lazily, so that only one batch of operations
+        exists at a time when they are consumed by :meth:`_batch_operations`.
+
+        The rows are assembled from the column values directly rather than through
+        ``df.to_dict('records')``, see :meth:`_get_column_values`.
+
+        Each row is encoded to BSON once with the `codec_options` of the target collection
+        and wrapped in a :class:`bson.raw_bson.RawBSONDocument`, whose bytes are copied as is
+        whenever the bulk write command is encoded, including on retries.
+
+        If `object_id_primary_key` is True, the primary key column is converted to
+        :class:`bson.ObjectId` in a single pass over the column.
+        """
+        if not df.columns.is_unique:
+            duplicated = df.columns[df.columns.duplicated()].unique().tolist()
+            raise ValueError(f'DataFrame columns must be unique, found duplicated columns: {duplicated}')
+
+        columns = df.columns.tolist()
+        arrays = [MongoDBHelper._get_column_values(df[column]) for column in columns]
+        pk_index = columns.index(primary_key_column)
+        if object_id_primary_key:
+            arrays[pk_index] = MongoDBHelper._to_object_ids(arrays[pk_index], primary_key_column)
+        if codec_options is None:
+            codec_options = CodecOptions()
+
+        def _raw(row):
+            return RawBSONDocument(encode(dict(zip(columns, row)), codec_options=codec_options))
+
+        def _operations():
+            for row in zip(*arrays):
+                if mode == 'insert':
+                    yield InsertOne(_raw(row))
+                elif mode == 'replace':
+                    yield ReplaceOne(filter={primary_key_column: row[pk_index]},
+                                     replacement=_raw(row),
+                                     upsert=True,
+                                     )
+                else:
+                    yield UpdateOne(filter={primary_key_column: row[pk_index]},
+                                    update={'$set': _raw(row)},
+                                    upsert=True,
+                                    )
+
+        return _operations()
+
+    @staticmethod
+    def _get_column_values(series: pd.Series) -> List[Any]:
+        """
+        Get the values of a column as a list of values which can be encoded to BSON.
+
+        ``Series.tolist`` converts the values of numpy dtypes to native Python types. Object and
+        extension dtypes may still hold numpy scalars, which are converted with ``.item()``, and
+        ``pd.NA``, which is converted to None.
+        """
+        values = series.tolist()
+        if isinstance(series.dtype, np.dtype) and series.dtype != object:
+            return values
+
+        return [None if value is pd.NA else value.item() if isinstance(value, np.generic) else value
+                for value in values]
+
+    @staticmethod
+    def _to_object_ids(values: List[Any], column: str) -> List[ObjectId]:
+        """
+        Convert the values of a primary key column to :class:`bson.ObjectId`.
+
+        Missing values are rejected, since ``ObjectId(None)`` generates a new random id.
+        """
+        values = np.asarray(values, dtype=object)
+        if pd.isna(values).any():
+            raise ValueError(f'Primary key column {column!r} contains missing values, '
+                             'which cannot be converted to ObjectId')
+        return np.frompyfunc(ObjectId, 1, 1)(values).tolist()
+
+    def _get_changed_rows(self,
+                          collection: Collection,
+                          df: pd.DataFrame,
+                          primary_key_column: str,
+                          mode: Literal['set', 'replace'] = 'replace',
+                          object_id_primary_key: bool = False,
+                          ) -> pd.DataFrame:
+        """
+        Get the rows of a DataFrame which are missing from the collection or differ from the existing documents.
+
+        Missing values are considered equal. In 'replace' mode, a row also differs if the existing document
+        has fields other than ``_id`` which are not columns of the DataFrame. Rows whose primary key matches
+        several existing documents are always considered changed.
+
+        The rows are compared in chunks of `DIFF_CHUNK_SIZE` rows, which keeps the ``$in`` query below the
+        maximum BSON document size and bounds the number of existing documents loaded at a time.
+        """
+        pk_values = self._get_column_values(df[primary_key_column])
+        if object_id_primary_key:
+            pk_values = self._to_object_ids(pk_values, primary_key_column)
+
+        find_kwargs = {}
+        if mode == 'set':
+            find_kwargs['projection'] = {column: 1 for column in df.columns}
+
+        changed = np.zeros(len(df), dtype=bool)
+        for start in range(0, len(df), DIFF_CHUNK_SIZE):
+            stop = start + DIFF_CHUNK_SIZE
+            changed[start:stop] = self._get_changed_mask(collection, df.iloc[start:stop], pk_values[start:stop],
+                                                         primary_key_column, mode, find_kwargs)
+        return df[changed]
+
+    def _get_changed_mask(self,
+                          collection: Collection,
+                          df: pd.DataFrame,
+                          pk_values: List[Any],
+                          primary_key_column: str,
+                          mode: Literal['set', 'replace'],
+                          find_kwargs: dict,
+                          ) -> np.ndarray:
+        """
+        Get a boolean mask of the rows of a chunk of a DataFrame which are new or changed.
+        """
+        existing = self._find_df(collection, {primary_key_column: {'$in': pk_values}}, None, find_kwargs)
+        if existing.empty:
+            return np.ones(len(df), dtype=bool)
+
+        new = df.set_axis(pd.Index(pk_values), axis=0)
+        existing = existing.set_index(primary_key_column)
+        duplicated_keys = existing.index[existing.index.duplicated()]
+        existing = existing[~existing.index.duplicated()]
+        old = existing.reindex(index=new.index, columns=new.columns.drop(primary_key_column))
+        new = new.drop(columns=primary_key_column)
+
+        changed = ~((new == old) | (new.isna() & old.isna())).all(axis=1)
+        changed |= ~new.index.isin(existing.index) | new.index.isin(duplicated_keys)
+        if mode == 'replace':
+            extra_columns = existing.columns.difference(new.columns).drop('_id', errors='ignore')
+            if len(extra_columns) > 0:
+                changed |= existing[extra_columns].notna().any(axis=1).reindex(new.index, fill_value=False)
+        return changed.to_numpy()
+
+    @staticmethod
+    def _batch_operations(operations: Iterator[Any], batch_size: int) -> Iterator[List[Any]]:
+        """
+        Split the write operations into consecutive batches of at most `batch_size` operations.
+        """
+        while True:
+            batch = list(islice(operations, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _log_upsert_result(self,
+                           database_name: str,
+                           collection_name: str,
+                           matched_count: int,
+                           modified_count: int,
+                           upserted_count: int,
+                           inserted_count: int,
+                           skipped_count: int = None,
+                           ) -> None:
+        """
+        Log the counters of the bulk writes of an upsert at debug level.
+        """
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+
+        message = 'For %s.%s - %d matched, %d modified, %d upserted, %d inserted'
+        args = [database_name, collection_name, matched_count, modified_count, upserted_count, inserted_count]
+        if skipped_count is not None:
+            message += ', %d skipped'
+            args.append(skipped_count)
+        self._logger.debug(message, *args)
+
+    def get_df(self,
+               database_name: str,
+               collection_name: str,
+               filter: dict = None,
+               schema: Optional['Schema'] = None,
+               projection: Union[List[str], Dict[str, Any]] = None,
+               batch_size: int = 10000,
+               sort: List[Tuple[str, int]] = None,
+               limit: int = None,
+               n_partitions: int = 1,
+               spill_to: str = None,
+               ) -> Union[pd.DataFrame, str]:
         """
         Retrieves data from a MongoDB collection and returns it as a pandas DataFrame.
 
+        If `pymongoarrow` is installed, the query result is decoded from BSON directly into
+        Arrow column buffers and converted to a DataFrame, avoiding the creation of a Python
+        dict per document. Otherwise, the documents are loaded with PyMongo and converted
+        with :class:`pandas.DataFrame`.
+
         Parameters
         ----------
         database_name : str
@@ -335,14 +961,173 @@ class MongoDBHelper:
             The name of the MongoDB collection.
         filter : dict, optional
             A dictionary representing the query string. Default is None.
+        schema : pymongoarrow.schema.Schema, optional
+            The schema of the result. Passing a schema skips the type inference from the first
+            document of the result. Only used if `pymongoarrow` is installed. Default is None.
+        projection : list of str or dict, optional
+            The fields to retrieve, either as a list of column names or as a MongoDB projection.
+            A list excludes the ``_id`` field unless it is listed. If omitted and a `schema` is
+            given, only the fields of the schema are retrieved. Default is None.
+        batch_size : int, optional
+            The number of documents returned per batch by the server. Default is 10000.
+        sort : list of (str, int), optional
+            A list of ``(key, direction)`` pairs specifying the sort order. Default is None.
+        limit : int, optional
+            The maximum number of documents to retrieve. Default is None.
+        n_partitions : int, optional
+            The number of ``_id`` ranges retrieved in parallel threads. The ranges are computed with
+            a ``$bucketAuto`` aggregation and cannot be combined with `sort` or `limit`. If the ``_id``
+            values are of different BSON types, the documents are retrieved with a single query. The
+            client ``maxPoolSize`` should be at least `n_partitions`. Default is 1.
+        spill_to : str, optional
+            The path of a Parquet file to write the result to instead of returning a DataFrame.
+            The result is retrieved in ``_id`` ranges of about 100000 documents, so that memory use
+            does not depend on the size of the result. If the ``_id`` values are of different BSON
+            types, the result is retrieved with a single query instead. Requires `pymongoarrow` and a
+            `schema`, and cannot be combined with `sort`, `limit` or `n_partitions`. Default is None.
 
         Returns
         -------
-        pd.DataFrame
-            A pandas DataFrame containing the data from MongoDB
+        pd.DataFrame or str
+            A pandas DataFrame containing the data from MongoDB, or the path of the Parquet file
+            if `spill_to` is given.
         """
-        self.database = database_name
-        self.collection = collection_name
-        list_dict = list(self.collection.find(filter))
-        df = pd.DataFrame(list_dict)
+        collection = self._get_collection(database_name, collection_name)
+
+        find_kwargs = {'batch_size': batch_size}
+        if isinstance(projection, list):
+            projection = {column: 1 for column in projection}
+            projection.setdefault('_id', 0)
+        if projection is not None:
+            find_kwargs['projection'] = projection
+        if sort is not None:
+            find_kwargs['sort'] = sort
+        if limit is not None:
+            find_kwargs['limit'] = limit
+
+        if spill_to is not None:
+            if sort is not None or limit is not None:
+                raise ValueError('Cannot use sort or limit when spilling to a Parquet file')
+            if n_partitions > 1:
+                raise ValueError('Cannot use more than one partition when spilling to a Parquet file')
+            return self._spill_to_parquet(collection, filter, schema, find_kwargs, spill_to)
+
+        if n_partitions > 1:
+            if sort is not None or limit is not None:
+                raise ValueError('Cannot use sort or limit with more than one partition')
+            return self._get_partitioned_df(collection, filter, schema, find_kwargs, n_partitions)
+
+        return self._find_df(collection, filter, schema, find_kwargs)
+
+    @staticmethod
+    def _find_df(collection: Collection, filter: Optional[dict], schema: Optional['Schema'], find_kwargs: dict
+                 ) -> pd.DataFrame:
+        """
+        Run a find query and load the result into a pandas DataFrame.
+
+        Without `pymongoarrow`, the documents are accumulated into one list per field while iterating
+        the cursor, rather than into a list of documents. Fields missing from a document are NaN.
+        """
+        if find_pandas_all is not None:
+            return find_pandas_all(collection, filter or {}, schema=schema, **find_kwargs)
+
+        columns: Dict[str, list] = {}
+        n_rows = 0
+        for document in collection.find(filter, **find_kwargs):
+            for key, value in document.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [np.nan] * n_rows
+                column.append(value)
+            n_rows += 1
+            if len(document) < len(columns):
+                for column in columns.values():
+                    if len(column) < n_rows:
+                        column.append(np.nan)
+        df = pd.DataFrame(columns)
         return df
+
+    def _get_partitioned_df(self,
+                            collection: Collection,
+                            filter: Optional[dict],
+                            schema: Optional['Schema'],
+                            find_kwargs: dict,
+                            n_partitions: int,
+                            ) -> pd.DataFrame:
+        """
+        Split the documents matching the filter into ``_id`` ranges and load them in parallel threads.
+        """
+        filters = self._get_id_range_filters(collection, filter, n_partitions)
+        with ThreadPoolExecutor(max_workers=len(filters)) as executor:
+            dfs = list(executor.map(lambda f: self._find_df(collection, f, schema, find_kwargs), filters))
+        return pd.concat(dfs, ignore_index=True)
+
+    @staticmethod
+    def _get_id_range_filters(collection: Collection, filter: Optional[dict], n_partitions: int) -> List[dict]:
+        """
+        Split the documents matching the filter into at most `n_partitions` ``_id`` ranges of similar sizes.
+
+        Returns the filter of each range, or only the filter itself if no document matches or if the
+        ``_id`` values are of different BSON types. ``$bucketAuto`` sorts the values across types,
+        but range queries only match values of the type of their bounds.
+        """
+        buckets = list(collection.aggregate([
+            {'$match': filter or {}},
+            {'$bucketAuto': {'groupBy': '$_id', 'buckets': n_partitions}},
+        ], allowDiskUse=True))
+        bound_types = {MongoDBHelper._get_bson_type_class(bucket['_id'][bound])
+                       for bucket in buckets for bound in ('min', 'max')}
+        if len(bound_types) != 1:
+            return [filter]
+
+        # The upper bound of a bucket is the lower bound of the next one, except for the last bucket
+        filters = []
+        for i, bucket in enumerate(buckets):
+            upper_operator = '$lte' if i == len(buckets) - 1 else '$lt'
+            id_range = {'_id': {'$gte': bucket['_id']['min'], upper_operator: bucket['_id']['max']}}
+            filters.append({'$and': [filter, id_range]} if filter else id_range)
+        return filters
+
+    @staticmethod
+    def _get_bson_type_class(value: Any) -> Any:
+        """
+        Get the class of values which can be compared with a value in a range query.
+
+        All numeric types are comparable with each other. Other values are only comparable
+        with values of the same type.
+        """
+        if isinstance(value, bool):
+            return bool
+        if isinstance(value, (int, float, Int64, Decimal128)):
+            return 'number'
+        return type(value)
+
+    def _spill_to_parquet(self,
+                          collection: Collection,
+                          filter: Optional[dict],
+                          schema: Optional['Schema'],
+                          find_kwargs: dict,
+                          path: str,
+                          ) -> str:
+        """
+        Write the documents matching the filter to a Parquet file, one ``_id`` range at a time.
+        """
+        if find_arrow_all is None:
+            raise ImportError('Please install pymongoarrow to spill query results to Parquet')
+        if schema is None:
+            raise ValueError('Please specify the schema of the result to spill it to Parquet')
+
+        # Only a rough number of ranges is needed, so the collection is not scanned without a filter
+        count = collection.count_documents(filter) if filter else collection.estimated_document_count()
+        n_partitions = max(1, math.ceil(count / SPILL_CHUNK_SIZE))
+        writer = None
+        try:
+            for range_filter in self._get_id_range_filters(collection, filter, n_partitions):
+                table = find_arrow_all(collection, range_filter or {}, schema=schema, **find_kwargs)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return path
@@ -0,0 +1,300 @@
+import asyncio
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+from src.mongodb_helper import MongoDBHelper
+
+
+def test_build_upsert_operations_boxes_values():
+    df = pd.DataFrame({'_id': [1, 2],
+                       'nullable_int': pd.array([1, None], dtype='Int64'),
+                       'mixed': pd.Series([np.int64(1), 'a'], dtype=object),
+                       'nullable_str': pd.array(['x', None], dtype='string'),
+                       })
+    operations = list(MongoDBHelper._build_upsert_operations(df, '_id'))
+    documents = [dict(operation._doc) for operation in operations]
+    assert documents == [{'_id': 1, 'nullable_int': 1, 'mixed': 1, 'nullable_str': 'x'},
+                         {'_id': 2, 'nullable_int': None, 'mixed': 'a', 'nullable_str': None}]
+
+
+def test_build_upsert_operations_rejects_duplicated_columns():
+    df = pd.DataFrame([[1, 2, 3]], columns=['_id', 'a', 'a'])
+    with pytest.raises(ValueError, match='duplicated'):
+        MongoDBHelper._build_upsert_operations(df, '_id')
+
+
+def test_client_cache_key_with_list_options():
+    helper = MongoDBHelper.__new__(MongoDBHelper)
+    helper.uri = 'mongodb://localhost:27017/'
+    helper.config = None
+    helper.client_options = {'compressors': ['zlib'], 'event_listeners': [object()]}
+    key = helper._get_client_cache_key()
+    assert key is not None
+    assert hash(key) == hash(helper._get_client_cache_key())
+
+    helper.client_options = {'unhashable': [set()]}
+    assert helper._get_client_cache_key() is None
+
+
+class StubCollection:
+    """
+    A collection returning fixed documents and aggregation results.
+    """
+
+    def __init__(self, documents=(), buckets=()):
+        self.documents = list(documents)
+        self.buckets = list(buckets)
+        self.aggregate_kwargs = None
+
+    def find(self, filter=None, **kwargs):
+        return iter(self.documents)
+
+    def aggregate(self, pipeline, **kwargs):
+        self.aggregate_kwargs = kwargs
+        return iter(self.buckets)
+
+
+def test_get_id_range_filters_bounds():
+    collection = StubCollection(buckets=[{'_id': {'min': 1, 'max': 10}, 'count': 9},
+                                         {'_id': {'min': 10, 'max': 20}, 'count': 9},
+                                         {'_id': {'min': 20, 'max': 25.5}, 'count': 6},
+                                         ])
+    filters = MongoDBHelper._get_id_range_filters(collection, None, 3)
+    assert filters == [{'_id': {'$gte': 1, '$lt': 10}},
+                       {'_id': {'$gte': 10, '$lt': 20}},
+                       {'_id': {'$gte': 20, '$lte': 25.5}},
+                       ]
+    assert collection.aggregate_kwargs == {'allowDiskUse': True}
+
+    filters = MongoDBHelper._get_id_range_filters(collection, {'a': 1}, 3)
+    assert filters[0] == {'$and': [{'a': 1}, {'_id': {'$gte': 1, '$lt': 10}}]}
+
+
+def test_get_id_range_filters_falls_back_on_mixed_types():
+    collection = StubCollection(buckets=[{'_id': {'min': 1, 'max': 'a'}, 'count': 2},
+                                         {'_id': {'min': 'a', 'max': 'z'}, 'count': 2},
+                                         ])
+    assert MongoDBHelper._get_id_range_filters(collection, {'a': 1}, 2) == [{'a': 1}]
+    assert MongoDBHelper._get_id_range_filters(StubCollection(), None, 2) == [None]
+
+
+def _helper():
+    return MongoDBHelper.__new__(MongoDBHelper)
+
+
+def test_get_changed_rows():
+    collection = StubCollection(documents=[{'_id': 1, 'a': 'x', 'b': 1.0},
+                                           {'_id': 2, 'a': 'y', 'b': 5.0},
+                                           {'_id': 3, 'a': None, 'b': None},
+                                           {'_id': 5, 'a': 'v', 'b': 4.0, 'extra': 1},
+                                           ])
+    df = pd.DataFrame({'_id': [1, 2, 3, 4, 5],
+                       'a': ['x', 'y', None, 'z', 'v'],
+                       'b': [1.0, 2.0, np.nan, 3.0, 4.0],
+                       })
+    changed = _helper()._get_changed_rows(collection, df, '_id', 'replace')
+    assert changed['_id'].tolist() == [2, 4, 5]
+
+    changed = _helper()._get_changed_rows(collection, df, '_id', 'set')
+    assert changed['_id'].tolist() == [2, 4]
+
+
+def test_get_changed_rows_with_duplicated_keys():
+    collection = StubCollection(documents=[{'_id': 1, 'key': 'a', 'value': 1},
+                                           {'_id': 2, 'key': 'a', 'value': 1},
+                                           {'_id': 3, 'key': 'b', 'value': 2},
+                                           ])
+    df = pd.DataFrame({'key': ['a', 'b'], 'value': [1, 2]})
+    changed = _helper()._get_changed_rows(collection, df, 'key', 'set')
+    assert changed['key'].tolist() == ['a']
+
+
+class StubBulkWriteResult:
+    acknowledged = True
+
+    def __init__(self, operations):
+        self.matched_count = 0
+        self.modified_count = 0
+        self.upserted_count = len(operations)
+        self.inserted_count = 0
+
+
+class StubWriteCollection:
+    """
+    A collection recording the calls of an upsert.
+    """
+    codec_options = MongoDBHelper._DEFAULT_CODEC_OPTIONS
+
+    def __init__(self, indexes=None):
+        self.calls = []
+        self.indexes = indexes or {'_id_': {'key': [('_id', 1)], 'v': 2}}
+
+    def index_information(self):
+        return self.indexes
+
+    def create_index(self, key, **kwargs):
+        self.calls.append(('create_index', key, kwargs))
+
+    def bulk_write(self, operations, **kwargs):
+        self.calls.append(('bulk_write', len(operations), kwargs))
+        return StubBulkWriteResult(operations)
+
+
+class AsyncStubWriteCollection(StubWriteCollection):
+    async def index_information(self):
+        return super().index_information()
+
+    async def create_index(self, key, **kwargs):
+        return super().create_index(key, **kwargs)
+
+    async def bulk_write(self, operations, **kwargs):
+        return super().bulk_write(operations, **kwargs)
+
+    def with_options(self, **kwargs):
+        return self
+
+
+def _upsert_helper(collection):
+    helper = _helper()
+    helper._indexed = set()
+    helper._collection_cache = {('db', 'coll'): collection}
+    helper.codec_options = MongoDBHelper._DEFAULT_CODEC_OPTIONS
+    helper._logger = logging.getLogger(__name__)
+    return helper
+
+
+class StubAsyncClient(dict):
+    """
+    A Motor client returning fixed collections.
+    """
+
+    def __init__(self, collection=None):
+        super().__init__({'db': {'coll': collection}})
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _async_upsert_helper(monkeypatch, collection=None):
+    monkeypatch.setattr('src.mongodb_helper.AsyncIOMotorClient',
+                        lambda *args, **kwargs: StubAsyncClient(collection))
+    helper = _upsert_helper(collection)
+    helper.uri = 'mongodb://localhost:27017/'
+    helper.config = None
+    helper.client_options = {}
+    helper._async_client = None
+    helper._async_client_loop = None
+    helper._event_loop = None
+    return helper
+
+
+def test_upsert_df_and_aupsert_df_make_the_same_calls(monkeypatch):
+    df = pd.DataFrame({'key': [1, 2, 3], 'value': ['a', 'b', 'c']})
+    collection = StubWriteCollection()
+    _upsert_helper(collection).upsert_df(df, 'db', 'coll', 'key', batch_size=2)
+
+    async_collection = AsyncStubWriteCollection()
+    helper = _async_upsert_helper(monkeypatch, async_collection)
+    asyncio.run(helper.aupsert_df(df, 'db', 'coll', 'key', batch_size=2))
+
+    assert collection.calls == async_collection.calls == [
+        ('create_index', 'key', {'unique': False}),
+        ('bulk_write', 2, {'ordered': False, 'bypass_document_validation': False}),
+        ('bulk_write', 1, {'ordered': False, 'bypass_document_validation': False}),
+    ]
+
+
+def test_upsert_dfs_rejects_running_event_loop():
+    async def _upsert():
+        _helper().upsert_dfs([])
+
+    with pytest.raises(RuntimeError, match='running event loop'):
+        asyncio.run(_upsert())
+
+
+def test_find_df_matches_dataframe_of_documents(monkeypatch):
+    monkeypatch.setattr('src.mongodb_helper.find_pandas_all', None)
+    documents = [{'_id': 1, 'a': 'x'},
+                 {'_id': 2, 'b': 2.0},
+                 {'_id': 3, 'a': 'z', 'b': 3, 'c': True},
+                 ]
+    df = MongoDBHelper._find_df(StubCollection(documents=documents), None, None, {})
+    pd.testing.assert_frame_equal(df, pd.DataFrame(documents))
+
+    df = MongoDBHelper._find_df(StubCollection(), None, None, {})
+    assert df.empty
+
+
+def test_upsert_df_keeps_existing_primary_key_index():
+    collection = StubWriteCollection(indexes={'_id_': {'key': [('_id', 1)], 'v': 2},
+                                              'key_1': {'key': [('key', 1)], 'unique': True, 'v': 2},
+                                              })
+    helper = _upsert_helper(collection)
+    df = pd.DataFrame({'key': [1, 2], 'value': ['a', 'b']})
+    helper.upsert_df(df, 'db', 'coll', 'key')
+    helper.upsert_df(df, 'db', 'coll', 'key')
+    assert [call[0] for call in collection.calls] == ['bulk_write', 'bulk_write']
+    assert ('db', 'coll', 'key') in helper._indexed
+
+
+class DiffStubWriteCollection(StubWriteCollection):
+    """
+    A collection recording the calls of an upsert, including the lookups of existing documents.
+    """
+
+    def __init__(self, documents=()):
+        super().__init__()
+        self.documents = list(documents)
+
+    def find(self, filter=None, **kwargs):
+        self.calls.append(('find', filter['key']['$in']))
+        return iter([document for document in self.documents if document['key'] in filter['key']['$in']])
+
+
+def test_upsert_df_diffs_in_chunks_after_creating_index(monkeypatch):
+    monkeypatch.setattr('src.mongodb_helper.find_pandas_all', None)
+    monkeypatch.setattr('src.mongodb_helper.DIFF_CHUNK_SIZE', 2)
+    collection = DiffStubWriteCollection(documents=[{'_id': 1, 'key': 1, 'value': 'a'},
+                                                    {'_id': 3, 'key': 3, 'value': 'x'},
+                                                    ])
+    df = pd.DataFrame({'key': [1, 2, 3], 'value': ['a', 'b', 'c']})
+    _upsert_helper(collection).upsert_df(df, 'db', 'coll', 'key', mode='set', diff_against_existing=True)
+    assert collection.calls == [
+        ('create_index', 'key', {'unique': False}),
+        ('find', [1, 2]),
+        ('find', [3]),
+        ('bulk_write', 2, {'ordered': False, 'bypass_document_validation': False}),
+    ]
+
+
+def test_async_client_is_recreated_for_each_event_loop(monkeypatch):
+    helper = _async_upsert_helper(monkeypatch)
+
+    async def _get_client():
+        assert helper.async_client is helper.async_client
+        return helper.async_client
+
+    first_client = asyncio.run(_get_client())
+    second_client = asyncio.run(_get_client())
+    assert second_client is not first_client
+    assert first_client.closed and not second_client.closed
+
+    helper.upsert_dfs([])
+    event_loop = helper._event_loop
+    helper.close()
+    assert second_client.closed and helper._async_client is None
+    assert event_loop.is_closed() and helper._event_loop is None
+
+
+def test_to_object_ids():
+    object_id = ObjectId()
+    assert MongoDBHelper._to_object_ids([str(object_id), object_id], 'key') == [object_id, object_id]
+
+    for values in ([str(object_id), None], [str(object_id), np.nan], [pd.NA]):
+        with pytest.raises(ValueError, match='missing values'):
+            MongoDBHelper._to_object_ids(values, 'key')